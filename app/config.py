@@ -1,23 +1,39 @@
 """
 Configuration Management for ThoughtCaptcha Backend.
 
-This module loads application settings from environment variables using Pydantic.
-It ensures that required settings like database URLs and API keys are present.
+This module loads application settings from environment variables into a
+msgspec Struct. It ensures that required settings like database URLs and
+API keys are present.
 """
 
 import os
-from pydantic_settings import BaseSettings, SettingsConfigDict
 from functools import lru_cache
 
-class Settings(BaseSettings):
-    """Application settings loaded from environment variables."""
-    # Load .env file if it exists (useful for local development)
-    # In production (like Railway), env vars are usually set directly.
-    model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8', extra='ignore')
+import msgspec
+from dotenv import dotenv_values
 
+class Settings(msgspec.Struct, frozen=True):
+    """Application settings loaded from environment variables."""
     DATABASE_URL: str
     OPENROUTER_API_KEY: str = "" # Default to empty string if not set
-    FRONTEND_ORIGIN_URL: str = "*" # Default to allow all origins for simplicity in demo
+    FRONTEND_ORIGIN_URL: str = "*" # Comma-separated list of origins; default allows all for simplicity in demo
+    FRONTEND_ORIGIN_REGEX: str | None = None # Optional regex for extra origins, e.g. wildcard subdomains
+
+    # Create missing tables/indexes at startup. Set to False once the schema
+    # is in place to skip the catalog round-trips on every cold start.
+    RUN_INIT_DB: bool = True
+
+    # --- Database Connection Pool Settings ---
+    # Pools are per worker process; see README for sizing guidance.
+    DB_POOL_SIZE: int = 20 # Connections kept open (and pre-created at startup)
+    DB_MAX_OVERFLOW: int = 10 # Extra connections allowed beyond pool_size under burst load
+    DB_POOL_TIMEOUT: int = 30 # Seconds to wait for a free connection before erroring
+    DB_POOL_RECYCLE: int = 1800 # Seconds after which a connection is replaced
+
+    @property
+    def FRONTEND_ORIGINS(self) -> tuple[str, ...]:
+        """FRONTEND_ORIGIN_URL split on commas, with whitespace and empty entries removed."""
+        return tuple(origin.strip() for origin in self.FRONTEND_ORIGIN_URL.split(",") if origin.strip())
 
     # --- OpenRouter Specific Settings (Optional - Can be expanded later) ---
     # OPENROUTER_MODEL: str = "openai/gpt-3.5-turbo" # Example default model
@@ -29,7 +45,12 @@ def get_settings() -> Settings:
     Returns the application settings instance.
     Uses lru_cache to load settings only once.
     """
-    return Settings()
+    # Load .env file if it exists (useful for local development)
+    # In production (like Railway), env vars are usually set directly and take precedence.
+    env = {key: value for key, value in dotenv_values('.env').items() if value is not None}
+    env.update(os.environ)
+    # strict=False lets msgspec coerce the raw strings to int/bool fields; unknown keys are ignored
+    return msgspec.convert(env, Settings, strict=False)
 
 # Example usage (typically imported in other modules):
 # from .config import get_settings
@@ -5,104 +5,237 @@ This module provides functions to interact with the database models,
 encapsulating the database logic.
 """
 
+import asyncio
+import datetime
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+from cachetools import TTLCache
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload 
-from sqlalchemy import desc, update
+from sqlalchemy.orm import joinedload
+from sqlalchemy import desc, insert, lambda_stmt, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 from . import models, schemas
 
+# --- In-Process Read Cache ---
+# The current assignment and the system prompt are read on nearly every
+# request but change only through the write functions below, which
+# invalidate them. Plain dataclasses are cached instead of ORM objects so
+# they stay usable after the session that loaded them is closed.
+
+@dataclass(frozen=True)
+class AssignmentSnapshot:
+    """Detached, read-only copy of an Assignment row."""
+    id: int
+    prompt_text: str
+    is_current: bool
+    created_at: datetime.datetime
+    updated_at: datetime.datetime | None
+
+@dataclass(frozen=True)
+class SystemPromptSnapshot:
+    """Detached, read-only copy of the SystemPrompt row."""
+    id: int
+    prompt_text: str
+
+CACHE_TTL_SECONDS = 30
+_CURRENT_ASSIGNMENT_KEY = "current_assignment"
+_SYSTEM_PROMPT_KEY = "system_prompt"
+_MISSING = object()
+
+_cache = TTLCache(maxsize=2, ttl=CACHE_TTL_SECONDS)
+_cache_lock = asyncio.Lock()
+# Bumped on every write. A reader only stores what it loaded if no write
+# happened meanwhile, so a slow read can't overwrite newer data.
+_current_assignment_generation = 0
+_system_prompt_generation = 0
+
+def invalidate_current_assignment() -> None:
+    """
+    Drops the cached current assignment. The write functions call this before
+    writing; endpoints call it again after committing, so a read that saw the
+    old committed row in between doesn't stay cached.
+    """
+    global _current_assignment_generation
+    _current_assignment_generation += 1
+    _cache.pop(_CURRENT_ASSIGNMENT_KEY, None)
+
+def _invalidate_system_prompt() -> None:
+    global _system_prompt_generation
+    _system_prompt_generation += 1
+    _cache.pop(_SYSTEM_PROMPT_KEY, None)
+
+def cache_system_prompt(db_prompt: models.SystemPrompt) -> None:
+    """
+    Writes a committed system prompt through to the cache, so the next
+    question generation doesn't need a database round-trip to see it.
+    """
+    global _system_prompt_generation
+    _system_prompt_generation += 1
+    _cache[_SYSTEM_PROMPT_KEY] = SystemPromptSnapshot(id=db_prompt.id, prompt_text=db_prompt.prompt_text)
+
+# --- Column Sets for Row-Based List Queries ---
+
+_ASSIGNMENT_COLUMNS = (
+    models.Assignment.id,
+    models.Assignment.prompt_text,
+    models.Assignment.is_current,
+    models.Assignment.created_at,
+    models.Assignment.updated_at,
+)
+
+_SUBMISSION_COLUMNS = (
+    models.Submission.id,
+    models.Submission.original_content,
+    models.Submission.generated_question,
+    models.Submission.student_response,
+    models.Submission.assignment_id,
+    models.Submission.created_at,
+    models.Submission.updated_at,
+)
+
+def _submission_row_to_dict(row) -> dict:
+    """Builds a submission dict from a joined row, nesting the assignment columns."""
+    submission = {column.key: row[column.key] for column in _SUBMISSION_COLUMNS}
+    submission["assignment"] = None
+    if row["assignment__id"] is not None:
+        submission["assignment"] = {
+            column.key: row[f"assignment__{column.key}"] for column in _ASSIGNMENT_COLUMNS
+        }
+    return submission
+
 # --- Assignment CRUD Operations ---
 
 async def create_assignment(db: AsyncSession, assignment: schemas.AssignmentCreate) -> models.Assignment:
     """
     Creates a new assignment record in the database.
     """
-    db_assignment = models.Assignment(
-        prompt_text=assignment.prompt_text,
-        is_current=assignment.is_current
-    )
-    db.add(db_assignment)
-    await db.flush()
-    await db.refresh(db_assignment)
-    
     # If this assignment is set as current, ensure all others are not current
-    if db_assignment.is_current:
-        await set_current_assignment(db, db_assignment.id)
-    
-    return db_assignment
+    if assignment.is_current:
+        invalidate_current_assignment()
+        await _clear_current_assignment(db)
+
+    # INSERT ... RETURNING brings back the id and server defaults without a refresh SELECT
+    result = await db.execute(
+        insert(models.Assignment)
+        # is_current is optional; None means the column default (False), not NULL
+        .values(prompt_text=assignment.prompt_text, is_current=bool(assignment.is_current))
+        .returning(models.Assignment)
+    )
+    return result.scalar_one()
 
 async def get_assignment(db: AsyncSession, assignment_id: int) -> models.Assignment | None:
     """
     Retrieves a specific assignment by its ID.
     """
-    result = await db.execute(select(models.Assignment).filter(models.Assignment.id == assignment_id))
+    # lambda_stmt caches the constructed statement; only assignment_id is re-bound per call
+    result = await db.execute(
+        lambda_stmt(lambda: select(models.Assignment).filter(models.Assignment.id == assignment_id))
+    )
     return result.scalars().first()
 
-async def get_assignments(db: AsyncSession, skip: int = 0, limit: int = 100) -> list[models.Assignment]:
+async def get_assignments_rows(db: AsyncSession, skip: int = 0, limit: int = 100) -> list[dict]:
     """
-    Retrieves a list of all assignments, ordered by creation date (newest first).
+    Retrieves a list of all assignments as plain dicts, ordered by creation date (newest first).
+    Selects columns directly so no ORM instances are built for list responses.
     """
     result = await db.execute(
-        select(models.Assignment)
+        select(*_ASSIGNMENT_COLUMNS)
         .order_by(desc(models.Assignment.created_at))
         .offset(skip)
         .limit(limit)
     )
-    return result.scalars().all()
+    return [dict(row) for row in result.mappings()]
 
-async def get_current_assignment(db: AsyncSession) -> models.Assignment | None:
+async def get_current_assignment(db: AsyncSession) -> AssignmentSnapshot | None:
     """
     Finds the assignment where is_current is True.
+    Served from the in-process cache when fresh.
     """
-    result = await db.execute(select(models.Assignment).filter(models.Assignment.is_current == True))
-    return result.scalars().first()
+    cached = _cache.get(_CURRENT_ASSIGNMENT_KEY, _MISSING)
+    if cached is not _MISSING:
+        return cached
+
+    async with _cache_lock:
+        # Another request may have repopulated the cache while we waited
+        cached = _cache.get(_CURRENT_ASSIGNMENT_KEY, _MISSING)
+        if cached is not _MISSING:
+            return cached
+        generation = _current_assignment_generation
+
+        result = await db.execute(
+            lambda_stmt(lambda: select(models.Assignment).filter(models.Assignment.is_current))
+        )
+        db_assignment = result.scalars().first()
+        snapshot = None
+        if db_assignment:
+            snapshot = AssignmentSnapshot(
+                id=db_assignment.id,
+                prompt_text=db_assignment.prompt_text,
+                is_current=db_assignment.is_current,
+                created_at=db_assignment.created_at,
+                updated_at=db_assignment.updated_at,
+            )
+        if generation == _current_assignment_generation:
+            _cache[_CURRENT_ASSIGNMENT_KEY] = snapshot
+        return snapshot
 
 async def update_assignment(db: AsyncSession, assignment_id: int, assignment_update: schemas.AssignmentUpdate) -> models.Assignment | None:
     """
     Updates an assignment record.
     Returns the updated assignment object or None if not found.
     """
-    db_assignment = await get_assignment(db, assignment_id)
-    if not db_assignment:
-        return None
-    
+    invalidate_current_assignment()
+
+    # If setting this as current, ensure others are not current; the
+    # is_current=True write itself is folded into the single UPDATE below.
+    if assignment_update.is_current:
+        await _clear_current_assignment(db, keep_id=assignment_id)
+
     # Update fields if provided
-    if assignment_update.prompt_text is not None:
-        db_assignment.prompt_text = assignment_update.prompt_text
-    
-    if assignment_update.is_current is not None:
-        db_assignment.is_current = assignment_update.is_current
-        # If setting this as current, ensure others are not current
-        if assignment_update.is_current:
-            await set_current_assignment(db, assignment_id)
-    
-    db.add(db_assignment)
-    await db.flush()
-    await db.refresh(db_assignment)
-    return db_assignment
+    values = assignment_update.model_dump(exclude_none=True)
+    if not values:
+        return await get_assignment(db, assignment_id)
+
+    result = await db.execute(
+        update(models.Assignment)
+        .where(models.Assignment.id == assignment_id)
+        .values(**values)
+        .returning(models.Assignment)
+        .execution_options(synchronize_session=False, populate_existing=True)
+    )
+    return result.scalar_one_or_none()
+
+async def _clear_current_assignment(db: AsyncSession, keep_id: int | None = None) -> None:
+    """
+    Sets is_current to False on the current assignment, unless it is keep_id.
+    Must run before marking another row current: flipping both rows in one
+    statement can trip the ix_assignments_current unique index mid-update.
+    """
+    stmt = update(models.Assignment).where(models.Assignment.is_current)
+    if keep_id is not None:
+        stmt = stmt.where(models.Assignment.id != keep_id)
+    await db.execute(stmt.values(is_current=False).execution_options(synchronize_session=False))
 
 async def set_current_assignment(db: AsyncSession, assignment_id: int) -> models.Assignment | None:
     """
     Sets the specified assignment's is_current to True and all others to False.
     Returns the current assignment or None if not found.
     """
-    # First, set all assignments to not current
-    await db.execute(
+    invalidate_current_assignment()
+
+    await _clear_current_assignment(db, keep_id=assignment_id)
+
+    result = await db.execute(
         update(models.Assignment)
-        .where(models.Assignment.id != assignment_id)
-        .values(is_current=False)
+        .where(models.Assignment.id == assignment_id)
+        .values(is_current=True)
+        .returning(models.Assignment)
+        .execution_options(synchronize_session=False, populate_existing=True)
     )
-    
-    # Then set the specified one to current
-    db_assignment = await get_assignment(db, assignment_id)
-    if db_assignment:
-        db_assignment.is_current = True
-        db.add(db_assignment)
-        await db.flush()
-        await db.refresh(db_assignment)
-    
-    return db_assignment
+    return result.scalar_one_or_none()
 
 # --- Submission CRUD Operations ---
 
@@ -110,91 +243,155 @@ async def create_submission(db: AsyncSession, submission: schemas.SubmissionCrea
     """
     Creates a new submission record in the database.
     """
-    db_submission = models.Submission(
-        original_content=submission.original_content,
-        assignment_id=submission.assignment_id
+    # INSERT ... RETURNING brings back the id and server defaults without a refresh SELECT
+    result = await db.execute(
+        insert(models.Submission)
+        .values(original_content=submission.original_content, assignment_id=submission.assignment_id)
+        .returning(models.Submission)
     )
-    db.add(db_submission)
-    await db.flush() # Flush to get the ID before returning
-    await db.refresh(db_submission)
-    return db_submission
+    return result.scalar_one()
 
-async def get_submission(db: AsyncSession, submission_id: int) -> models.Submission | None:
+async def get_generated_question(db: AsyncSession, submission_id: int) -> str | None:
     """
-    Retrieves a specific submission by its ID, including its assignment.
+    Retrieves only the generated_question of a submission.
+    Returns None if the submission doesn't exist or has no question yet.
     """
     result = await db.execute(
-        select(models.Submission)
-        .options(selectinload(models.Submission.assignment))
-        .filter(models.Submission.id == submission_id)
+        lambda_stmt(
+            lambda: select(models.Submission.generated_question)
+            .filter(models.Submission.id == submission_id)
+        )
     )
-    return result.scalars().first()
+    return result.scalar_one_or_none()
 
-async def get_all_submissions(db: AsyncSession, skip: int = 0, limit: int = 100) -> list[models.Submission]:
+async def get_submission_with_assignment(db: AsyncSession, submission_id: int) -> models.Submission | None:
     """
-    Retrieves a list of all submissions, newest first, including their assignments.
+    Retrieves a specific submission by its ID, including its assignment.
+    The many-to-one assignment is joined in, so this is a single query.
     """
     result = await db.execute(
-        select(models.Submission)
-        .options(selectinload(models.Submission.assignment))
+        lambda_stmt(
+            lambda: select(models.Submission)
+            .options(joinedload(models.Submission.assignment))
+            .filter(models.Submission.id == submission_id)
+        )
+    )
+    return result.scalars().first()
+
+def _submission_rows_query(skip: int, limit: int):
+    """Builds the newest-first submission list query, with assignment columns joined in."""
+    return (
+        select(
+            *_SUBMISSION_COLUMNS,
+            *(column.label(f"assignment__{column.key}") for column in _ASSIGNMENT_COLUMNS)
+        )
+        .outerjoin(models.Submission.assignment)
         .order_by(desc(models.Submission.created_at))
         .offset(skip)
         .limit(limit)
     )
-    return result.scalars().all()
 
-async def update_submission_question(db: AsyncSession, submission_id: int, question: str) -> models.Submission | None:
+async def get_all_submissions_stream(db: AsyncSession, skip: int = 0, limit: int = 100) -> AsyncIterator[dict]:
+    """
+    Yields submissions as plain dicts, newest first, one at a time, each with
+    its assignment nested under "assignment" (or None).
+    Rows are read through a server-side cursor, so memory stays bounded for large limits.
+    """
+    result = await db.stream(_submission_rows_query(skip, limit))
+    async for row in result.mappings():
+        yield _submission_row_to_dict(row)
+
+async def update_submission_question(db: AsyncSession, submission_id: int, question: str) -> int | None:
     """
     Updates the generated_question field for a specific submission.
-    Returns the updated submission object or None if not found.
+    Returns the submission ID, or None if not found. Only the ID is returned
+    so the wide text columns aren't sent back over the wire.
     """
-    db_submission = await get_submission(db, submission_id)
-    if db_submission:
-        db_submission.generated_question = question
-        db.add(db_submission)
-        await db.flush()
-        await db.refresh(db_submission)
-    return db_submission
+    result = await db.execute(
+        update(models.Submission)
+        .where(models.Submission.id == submission_id)
+        .values(generated_question=question)
+        .returning(models.Submission.id)
+        .execution_options(synchronize_session=False)
+    )
+    return result.scalar_one_or_none()
 
-async def update_submission_response(db: AsyncSession, submission_id: int, response: str) -> models.Submission | None:
+async def update_submission_response(db: AsyncSession, submission_id: int, response: str) -> int | None:
     """
     Updates the student_response field for a specific submission.
-    Returns the updated submission object or None if not found.
+    Returns the submission ID, or None if not found. Only the ID is returned
+    so the wide text columns aren't sent back over the wire.
     """
-    db_submission = await get_submission(db, submission_id)
-    if db_submission:
-        db_submission.student_response = response
-        db.add(db_submission)
-        await db.flush()
-        await db.refresh(db_submission)
-    return db_submission
+    result = await db.execute(
+        update(models.Submission)
+        .where(models.Submission.id == submission_id)
+        .values(student_response=response)
+        .returning(models.Submission.id)
+        .execution_options(synchronize_session=False)
+    )
+    return result.scalar_one_or_none()
 
 # --- System Prompt CRUD ---
 
-async def get_system_prompt(db: AsyncSession) -> models.SystemPrompt:
+async def get_system_prompt(db: AsyncSession) -> SystemPromptSnapshot:
     """
     Retrieves the system prompt. If it doesn't exist, creates it with the default.
     Ensures only one prompt exists with ID=1.
+    Served from the in-process cache when fresh.
     """
-    # Try to get the prompt with ID 1
-    result = await db.execute(select(models.SystemPrompt).filter(models.SystemPrompt.id == 1))
-    db_prompt = result.scalars().first()
+    cached = _cache.get(_SYSTEM_PROMPT_KEY, _MISSING)
+    if cached is not _MISSING:
+        return cached
+
+    async with _cache_lock:
+        # Another request may have repopulated the cache while we waited
+        cached = _cache.get(_SYSTEM_PROMPT_KEY, _MISSING)
+        if cached is not _MISSING:
+            return cached
+        generation = _system_prompt_generation
+
+        # Try to get the prompt with ID 1
+        result = await db.execute(
+            lambda_stmt(lambda: select(models.SystemPrompt).filter(models.SystemPrompt.id == 1))
+        )
+        db_prompt = result.scalars().first()
+
+        if not db_prompt:
+            # If not found, create it with the default value from the model.
+            # ON CONFLICT keeps this race-free when several workers bootstrap
+            # the row at once; the no-op update lets RETURNING yield the
+            # existing row in that case.
+            result = await db.execute(
+                pg_insert(models.SystemPrompt)
+                .values(id=1, prompt_text=models.DEFAULT_SYSTEM_PROMPT)
+                .on_conflict_do_update(
+                    index_elements=[models.SystemPrompt.id],
+                    set_={"prompt_text": models.SystemPrompt.prompt_text},
+                )
+                .returning(models.SystemPrompt)
+                .execution_options(populate_existing=True)
+            )
+            db_prompt = result.scalar_one()
 
-    if not db_prompt:
-        # If not found, create it with the default value from the model
-        db_prompt = models.SystemPrompt(id=1)
-        db.add(db_prompt)
-        await db.flush() # Use flush + refresh to get the object back with defaults applied
-        await db.refresh(db_prompt)
-    return db_prompt
+        snapshot = SystemPromptSnapshot(id=db_prompt.id, prompt_text=db_prompt.prompt_text)
+        if generation == _system_prompt_generation:
+            _cache[_SYSTEM_PROMPT_KEY] = snapshot
+        return snapshot
 
 async def update_system_prompt(db: AsyncSession, prompt_update: schemas.PromptUpdate) -> models.SystemPrompt:
     """
     Updates the system prompt (identified by fixed ID=1).
     """
-    db_prompt = await get_system_prompt(db) # Use get_system_prompt to ensure it exists
-    db_prompt.prompt_text = prompt_update.prompt_text
-    db.add(db_prompt)
-    await db.flush()
-    await db.refresh(db_prompt)
-    return db_prompt 
\ No newline at end of file
+    _invalidate_system_prompt()
+
+    # Upsert: one statement whether or not the row exists yet
+    stmt = pg_insert(models.SystemPrompt).values(id=1, prompt_text=prompt_update.prompt_text)
+    result = await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[models.SystemPrompt.id],
+            set_={"prompt_text": stmt.excluded.prompt_text},
+        )
+        .returning(models.SystemPrompt)
+        .execution_options(populate_existing=True)
+    )
+    return result.scalar_one()
@@ -5,38 +5,83 @@ This module configures the SQLAlchemy engine and session management
 for asynchronous interaction with the PostgreSQL database.
 """
 
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker, declarative_base
+import asyncio
 
-from .config import get_settings
-
-settings = get_settings()
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine, AsyncSession
+from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-DATABASE_URL = settings.DATABASE_URL
+from .config import get_settings
 
-# Create the SQLAlchemy async engine
-# connect_args is useful for specific driver options, like SSL modes if needed later.
-# pool_pre_ping checks connections before use, helping prevent errors with stale connections.
-# echo=True can be useful for debugging SQL locally, but should be False in production.
-engine = create_async_engine(
-    DATABASE_URL,
-    pool_pre_ping=True,
-    # echo=True # Uncomment for local SQL logging
-)
+_engine: AsyncEngine | None = None
 
 # Create a configured "Session" class
 # expire_on_commit=False prevents attributes from being expired after commit,
 # which is often useful in async contexts with FastAPI dependencies.
-AsyncSessionLocal = sessionmaker(
-    bind=engine,
-    class_=AsyncSession,
+# It is bound to the engine by get_engine(); create sessions with new_session().
+AsyncSessionLocal = async_sessionmaker(
     expire_on_commit=False,
     autoflush=False,
-    autocommit=False
 )
 
+def get_engine() -> AsyncEngine:
+    """
+    Returns the SQLAlchemy async engine, creating it on first use.
+
+    Importing this module doesn't build a connection pool, so tools and
+    scripts that only need the models (or a pre-forking server master)
+    don't pay for one.
+    """
+    global _engine
+    if _engine is None:
+        settings = get_settings()
+        # connect_args is useful for specific driver options, like SSL modes if needed later.
+        # pool_pre_ping checks connections before use, helping prevent errors with stale connections.
+        # AsyncAdaptedQueuePool is the asyncio-compatible pool; plain QueuePool must not be used with asyncpg.
+        # echo=True can be useful for debugging SQL locally, but should be False in production.
+        _engine = create_async_engine(
+            settings.DATABASE_URL,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            pool_pre_ping=True,
+            connect_args={
+                # Per-connection prepared statement caches (asyncpg's own and SQLAlchemy's asyncpg adapter)
+                "statement_cache_size": 1024,
+                "prepared_statement_cache_size": 1024,
+                "server_settings": {
+                    # Our queries are small OLTP lookups; JIT compilation only adds planning latency
+                    "jit": "off",
+                    "application_name": "thoughtcaptcha",
+                },
+            },
+            # echo=True # Uncomment for local SQL logging
+        )
+        AsyncSessionLocal.configure(bind=_engine)
+    return _engine
+
+def new_session() -> AsyncSession:
+    """
+    Returns a new session from AsyncSessionLocal, creating the engine first if
+    needed. Use this rather than calling AsyncSessionLocal() directly, so
+    sessions work even where the app lifespan hasn't run.
+    """
+    get_engine()
+    return AsyncSessionLocal()
+
+async def dispose_engine() -> None:
+    """Closes pooled connections. The next get_engine() call creates a fresh engine."""
+    global _engine
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = None
+
 # Base class for declarative models
-Base = declarative_base()
+class Base(DeclarativeBase):
+    pass
+
 
 async def get_db() -> AsyncSession:
     """
@@ -44,7 +89,7 @@ async def get_db() -> AsyncSession:
 
     Manages the session lifecycle per request, ensuring it's closed properly.
     """
-    async with AsyncSessionLocal() as session:
+    async with new_session() as session:
         try:
             yield session
             await session.commit()
@@ -54,12 +99,43 @@ async def get_db() -> AsyncSession:
         finally:
             await session.close()
 
+async def get_db_ro() -> AsyncSession:
+    """
+    FastAPI dependency that yields an async database session for read-only endpoints.
+
+    Skips the COMMIT round-trip issued by get_db; the transaction is simply
+    rolled back when the connection is returned to the pool.
+    """
+    async with new_session() as session:
+        yield session
+
 async def init_db():
     """
     Initialize the database (create tables).
     This is a simple approach for demos. For production, use Alembic migrations.
     """
-    async with engine.begin() as conn:
+    async with get_engine().begin() as conn:
         # In a real app, avoid dropping tables like this
         # await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all) 
\ No newline at end of file
+        await conn.run_sync(Base.metadata.create_all)
+        # create_all skips tables that already exist, so also create any
+        # indexes added to a model after its table was first created.
+        await conn.run_sync(_create_missing_indexes)
+
+def _create_missing_indexes(sync_conn):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+async def warm_pool():
+    """
+    Pre-create DB_POOL_SIZE connections so the first requests don't pay connection setup.
+    SQLAlchemy opens pool connections lazily, unlike aiopg's min_size.
+    """
+    engine = get_engine()
+
+    async def _open_connection():
+        async with engine.connect():
+            pass
+
+    await asyncio.gather(*(_open_connection() for _ in range(get_settings().DB_POOL_SIZE)))
@@ -2,81 +2,150 @@
 Main FastAPI Application for ThoughtCaptcha Backend.
 
 This file defines the FastAPI app instance, includes CORS middleware,
-sets up logging, defines API endpoints (routers), and potentially
-includes startup/shutdown event handlers.
+sets up logging, defines API endpoints (routers), and the
+startup/shutdown lifespan handler.
 """
 
+import asyncio
+import atexit
+import hashlib
 import logging
-from fastapi import FastAPI, Depends, HTTPException, status
+import queue
+import msgspec
+from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, status
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 
 from . import crud, models, schemas, openrouter_client
-from .database import engine, get_db, init_db, AsyncSessionLocal
+from .database import get_engine, dispose_engine, get_db, get_db_ro, init_db, new_session, warm_pool
 from .config import get_settings
 
 # --- Logging Setup ---
-# Configure basic logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Configure basic logging. Records are handed to a queue and written by a
+# QueueListener thread, so log I/O doesn't block the event loop.
+_log_queue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+log_listener = QueueListener(_log_queue, _log_handler)
+_queue_handler = QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter('%(message)s')) # Full format is applied by _log_handler
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
+# Started together with the handler, so apps used without the lifespan
+# (scripts, TestClient) still log; stopping at exit flushes queued records
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
-# --- Application Setup ---
-settings = get_settings()
-
-# Create FastAPI app instance
-app = FastAPI(
-    title="ThoughtCaptcha API",
-    description="API for verifying student assignment authenticity.",
-    version="0.1.0",
-)
-
-# --- CORS Middleware ---
-# Set up CORS to allow requests from the frontend origin
-# In production, restrict origins to your actual frontend URL
-origins = [
-    settings.FRONTEND_ORIGIN_URL, # From .env file
-    # Add other origins if needed, e.g., localhost for development
-    # "http://localhost",
-    # "http://localhost:8080", # Common port for frontend dev servers
-]
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"], # Allow common methods
-    allow_headers=["*"], # Allow all headers for simplicity, can be restricted
-)
-
-# --- Event Handlers (Optional) ---
-@app.on_event("startup")
-async def on_startup():
-    """Actions to perform on application startup."""
+# --- Lifespan (Startup/Shutdown) ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Actions to perform on application startup and shutdown."""
+    settings = get_settings() # Cached; parsed once per worker process
     logger.info("Starting up ThoughtCaptcha API...")
-    # 1. Initialize database tables
-    await init_db()
-    logger.info("Database tables created/verified.")
+    get_engine() # Creates the engine (and its pool) in this worker at startup
+    # 1. Pre-create pooled database connections and, if enabled,
+    #    initialize database tables concurrently
+    startup_tasks = [warm_pool()]
+    if settings.RUN_INIT_DB:
+        startup_tasks.append(init_db())
+    await asyncio.gather(*startup_tasks)
+    logger.info("Database connection pool warmed up.")
+    if settings.RUN_INIT_DB:
+        logger.info("Database tables created/verified.")
 
     # 2. Ensure default system prompt exists (run *after* init_db)
     logger.info("Ensuring default system prompt exists...")
-    async with AsyncSessionLocal() as session:
+    async with new_session() as session:
         try:
             await crud.get_system_prompt(session) # Call this to create if not exists
             await session.commit()
             logger.info("Default system prompt check complete.")
         except Exception as e:
             await session.rollback()
-            logger.error(f"Error ensuring system prompt exists: {e}", exc_info=True)
+            logger.error("Error ensuring system prompt exists: %s", e, exc_info=True)
             # Decide if you want the app to fail startup here or continue
             # raise e # Uncomment to make startup fail on prompt error
 
-@app.on_event("shutdown")
-async def on_shutdown():
-    """Actions to perform on application shutdown."""
+    yield
+
     logger.info("Shutting down ThoughtCaptcha API...")
-    # await engine.dispose() # Clean up database engine resources
-    pass
+    await openrouter_client.close_client() # Close pooled OpenRouter connections
+    await dispose_engine() # Close pooled database connections
+
+# Create FastAPI app instance
+app = FastAPI(
+    title="ThoughtCaptcha API",
+    description="API for verifying student assignment authenticity.",
+    version="0.1.0",
+    lifespan=lifespan,
+)
+
+# --- CORS Middleware ---
+# Set up CORS to allow requests from the frontend origin(s)
+# In production, restrict origins to your actual frontend URL
+# Add other origins (e.g. http://localhost:8080 for development) as a
+# comma-separated FRONTEND_ORIGIN_URL, or match them with FRONTEND_ORIGIN_REGEX.
+class _SettingsCORSMiddleware(CORSMiddleware):
+    """
+    CORSMiddleware that reads its origins from the settings.
+    Starlette instantiates middleware when it first builds the stack, not in
+    add_middleware, so settings aren't parsed when this module is imported.
+    """
+
+    def __init__(self, app):
+        settings = get_settings()
+        super().__init__(
+            app,
+            allow_origins=settings.FRONTEND_ORIGINS,
+            allow_origin_regex=settings.FRONTEND_ORIGIN_REGEX,
+            allow_credentials=True,
+            allow_methods=["GET", "POST", "PUT"], # Only the methods the API serves; preflight OPTIONS is handled by the middleware
+            allow_headers=["Content-Type", "Authorization"], # Concrete list keeps preflight responses static
+        )
+
+app.add_middleware(_SettingsCORSMiddleware)
+
+# --- HTTP Caching for Read-Mostly Endpoints ---
+# The current assignment and the system prompt are polled by clients but only
+# change through explicit PUTs. Responses carry an ETag derived from the body,
+# so a changed record gets a new ETag and polling clients revalidate cheaply.
+# no-cache makes clients revalidate on every use, so a PUT is visible at once;
+# a matching If-None-Match is answered with a 304 from the in-process cache.
+CACHE_CONTROL = "no-cache"
+
+def _cached_json_response(request: Request, model: BaseModel) -> Response:
+    """Returns the model as JSON with ETag/Cache-Control, or a 304 if the client's copy is current."""
+    body = model.model_dump_json().encode()
+    etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": CACHE_CONTROL,
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        client_etags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in client_etags or "*" in client_etags:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# --- Responses for Freshly Written Rows ---
+# Write endpoints return the row the database just gave back via RETURNING.
+# That data is already well-typed, so build the response model without a
+# second validation pass and serialize it directly.
+
+def _written_row_response(schema: type[BaseModel], row, status_code: int = status.HTTP_200_OK) -> Response:
+    """Serializes a trusted ORM row as `schema` without re-validating it."""
+    model = schema.model_construct(**{name: getattr(row, name) for name in schema.model_fields})
+    return Response(content=model.model_dump_json(), status_code=status_code, media_type="application/json")
+
+# Shared msgspec encoder for list responses built from database rows
+_json_encoder = msgspec.json.Encoder()
 
 # --- API Endpoints ---
 
@@ -96,25 +165,34 @@ async def create_assignment(
     Creates a new assignment prompt.
     Returns the created assignment record including its ID.
     """
-    logger.info(f"Creating new assignment: {assignment.prompt_text[:50]}...")
+    logger.info("Creating new assignment: %.50s...", assignment.prompt_text)
     db_assignment = await crud.create_assignment(db=db, assignment=assignment)
-    logger.info(f"Assignment created with ID: {db_assignment.id}")
-    return db_assignment
+    if assignment.is_current:
+        # Commit before invalidating so the cache can't be refilled with the old current assignment
+        await db.commit()
+        crud.invalidate_current_assignment()
+    logger.info("Assignment created with ID: %s", db_assignment.id)
+    return _written_row_response(schemas.AssignmentRead, db_assignment, status.HTTP_201_CREATED)
 
 @app.get("/api/assignments", response_model=List[schemas.AssignmentRead], tags=["Assignments"])
 async def read_assignments(
     skip: int = 0,
     limit: int = 100,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db_ro)
 ):
     """Retrieve all assignment records."""
-    logger.info(f"Fetching assignments with skip={skip}, limit={limit}")
-    assignments = await crud.get_assignments(db, skip=skip, limit=limit)
-    return assignments
+    logger.info("Fetching assignments with skip=%s, limit=%s", skip, limit)
+    assignments = await crud.get_assignments_rows(db, skip=skip, limit=limit)
+    # Rows come straight from the database, so they're encoded without Pydantic validation
+    return Response(
+        content=_json_encoder.encode([schemas.AssignmentReadStruct(**row) for row in assignments]),
+        media_type="application/json",
+    )
 
 @app.get("/api/assignments/current", response_model=schemas.AssignmentRead, tags=["Assignments"])
 async def read_current_assignment(
-    db: AsyncSession = Depends(get_db)
+    request: Request,
+    db: AsyncSession = Depends(get_db_ro)
 ):
     """Retrieve the currently active assignment."""
     logger.info("Fetching current assignment")
@@ -122,7 +200,7 @@ async def read_current_assignment(
     if not assignment:
         logger.warning("No current assignment found")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No current assignment found")
-    return assignment
+    return _cached_json_response(request, schemas.AssignmentRead.model_validate(assignment))
 
 @app.put("/api/assignments/{assignment_id}", response_model=schemas.AssignmentRead, tags=["Assignments"])
 async def update_assignment(
@@ -133,12 +211,15 @@ async def update_assignment(
     """
     Update an existing assignment's details.
     """
-    logger.info(f"Updating assignment with ID: {assignment_id}")
+    logger.info("Updating assignment with ID: %s", assignment_id)
     db_assignment = await crud.update_assignment(db=db, assignment_id=assignment_id, assignment_update=assignment_update)
     if not db_assignment:
-        logger.warning(f"Assignment ID {assignment_id} not found for update.")
+        logger.warning("Assignment ID %s not found for update.", assignment_id)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Assignment not found")
-    return db_assignment
+    # Commit before invalidating so the cache can't be refilled with the old current assignment
+    await db.commit()
+    crud.invalidate_current_assignment()
+    return _written_row_response(schemas.AssignmentRead, db_assignment)
 
 @app.put("/api/assignments/{assignment_id}/set-current", response_model=schemas.AssignmentRead, tags=["Assignments"])
 async def set_current_assignment(
@@ -148,18 +229,62 @@ async def set_current_assignment(
     """
     Set an assignment as the current active one and make all others not current.
     """
-    logger.info(f"Setting assignment ID {assignment_id} as current")
+    logger.info("Setting assignment ID %s as current", assignment_id)
     db_assignment = await crud.set_current_assignment(db=db, assignment_id=assignment_id)
     if not db_assignment:
-        logger.warning(f"Assignment ID {assignment_id} not found when trying to set as current.")
+        logger.warning("Assignment ID %s not found when trying to set as current.", assignment_id)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Assignment not found")
-    return db_assignment
+    await db.commit()
+    crud.invalidate_current_assignment()
+    return _written_row_response(schemas.AssignmentRead, db_assignment)
 
 # --- Submission Endpoints ---
 
-@app.post("/api/submit-assignment", response_model=schemas.Submission, status_code=status.HTTP_201_CREATED, tags=["Submissions"])
+# Largest body a valid submission can produce: every character of
+# original_content JSON-escaped as a surrogate pair (12 bytes), plus room for
+# the other fields. Anything bigger is rejected before it's read into memory.
+MAX_SUBMISSION_BODY_BYTES = schemas.MAX_SUBMISSION_LENGTH * 12 + 1024
+
+def _body_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Request body exceeds {MAX_SUBMISSION_BODY_BYTES} bytes",
+    )
+
+async def _parse_submission(request: Request) -> schemas.SubmissionCreate:
+    """Dependency that validates the raw JSON body as a SubmissionCreate."""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_SUBMISSION_BODY_BYTES:
+        raise _body_too_large()
+    # Chunked uploads carry no Content-Length, so count while reading too
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > MAX_SUBMISSION_BODY_BYTES:
+            raise _body_too_large()
+        chunks.append(chunk)
+    body = b"".join(chunks)
+    try:
+        return schemas.SubmissionCreate.model_validate_json(body)
+    except ValidationError as e:
+        # Same 422 shape FastAPI produces for a declared body parameter
+        errors = [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)]
+        raise RequestValidationError(errors, body=body)
+
+@app.post(
+    "/api/submit-assignment",
+    response_model=schemas.Submission,
+    status_code=status.HTTP_201_CREATED,
+    tags=["Submissions"],
+    # The body is parsed by _parse_submission, so document it explicitly
+    openapi_extra={"requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": schemas.SubmissionCreate.model_json_schema()}},
+    }},
+)
 async def submit_assignment(
-    submission: schemas.SubmissionCreate,
+    submission: schemas.SubmissionCreate = Depends(_parse_submission),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -167,29 +292,60 @@ async def submit_assignment(
     Returns the created submission record including its ID.
     Can be linked to an assignment via assignment_id.
     """
-    logger.info(f"Received new submission: {submission.original_content[:50]}...")
+    logger.info("Received new submission: %.50s...", submission.original_content)
     
     # If no assignment_id is provided, try to use current assignment
     if submission.assignment_id is None:
         current_assignment = await crud.get_current_assignment(db)
         if current_assignment:
             submission.assignment_id = current_assignment.id
-            logger.info(f"Using current assignment ID: {submission.assignment_id} for submission")
+            logger.info("Using current assignment ID: %s for submission", submission.assignment_id)
     
     db_submission = await crud.create_submission(db=db, submission=submission)
-    logger.info(f"Submission created with ID: {db_submission.id}")
-    return db_submission
+    logger.info("Submission created with ID: %s", db_submission.id)
+    return _written_row_response(schemas.Submission, db_submission, status.HTTP_201_CREATED)
+
+# Largest page /api/submissions will stream in one response
+MAX_SUBMISSIONS_PAGE_SIZE = 1000
 
 @app.get("/api/submissions", response_model=List[schemas.SubmissionFullData], tags=["Submissions"])
 async def read_submissions(
-    skip: int = 0,
-    limit: int = 100,
-    db: AsyncSession = Depends(get_db)
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=MAX_SUBMISSIONS_PAGE_SIZE),
 ):
-    """Retrieve all submission records (for teacher view)."""
-    logger.info(f"Fetching submissions with skip={skip}, limit={limit}")
-    submissions = await crud.get_all_submissions(db, skip=skip, limit=limit)
-    return submissions
+    """
+    Retrieve all submission records (for teacher view).
+    The JSON array is streamed row by row, so large pages aren't held in memory.
+    """
+    logger.info("Fetching submissions with skip=%s, limit=%s", skip, limit)
+    stream = _stream_submissions_json_array(skip, limit)
+    # Run the query and take the first chunk before any headers go out, so a
+    # database error is a 500 rather than a truncated "200" array
+    first_chunk = await anext(stream)
+    return StreamingResponse(_prepend(first_chunk, stream), media_type="application/json")
+
+# The streaming response outlives the request's dependencies, so the stream owns its session
+
+def _encode_submission(row: dict) -> bytes:
+    assignment = row["assignment"]
+    return _json_encoder.encode(schemas.SubmissionFullDataStruct(**{
+        **row,
+        "assignment": schemas.AssignmentReadStruct(**assignment) if assignment else None,
+    }))
+
+async def _stream_submissions_json_array(skip: int, limit: int):
+    async with new_session() as session:
+        separator = b"["
+        async for row in crud.get_all_submissions_stream(session, skip=skip, limit=limit):
+            yield separator + _encode_submission(row)
+            separator = b","
+        # An empty result still has to be a valid JSON array
+        yield b"[]" if separator == b"[" else b"]"
+
+async def _prepend(first_chunk: bytes, stream):
+    yield first_chunk
+    async for chunk in stream:
+        yield chunk
 
 @app.post("/api/generate-question", response_model=schemas.QuestionGeneratedResponse, tags=["Verification"])
 async def generate_question(
@@ -201,20 +357,22 @@ async def generate_question(
     Uses both the assignment prompt and student response for context.
     """
     submission_id = request_data.submission_id
-    logger.info(f"Generating question for submission ID: {submission_id}")
-
-    db_submission = await crud.get_submission(db, submission_id)
-    if not db_submission:
-        logger.warning(f"Submission ID {submission_id} not found for question generation.")
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Submission not found")
+    logger.info("Generating question for submission ID: %s", submission_id)
 
-    if db_submission.generated_question:
-        logger.info(f"Question already exists for submission ID: {submission_id}. Returning existing question.")
+    # Fast path: only read the question column when it has already been generated
+    existing_question = await crud.get_generated_question(db, submission_id)
+    if existing_question:
+        logger.info("Question already exists for submission ID: %s. Returning existing question.", submission_id)
         return schemas.QuestionGeneratedResponse(
             submission_id=submission_id,
-            generated_question=db_submission.generated_question
+            generated_question=existing_question
         )
 
+    db_submission = await crud.get_submission_with_assignment(db, submission_id)
+    if not db_submission:
+        logger.warning("Submission ID %s not found for question generation.", submission_id)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Submission not found")
+
     # Get the assignment prompt
     assignment_prompt = "No specific assignment prompt provided."
     if db_submission.assignment:
@@ -223,11 +381,15 @@ async def generate_question(
     # Get the student's response
     student_response = db_submission.original_content
 
-    # Fetch the current system prompt
-    system_prompt_obj = await crud.get_system_prompt(db)
-    system_prompt = system_prompt_obj.prompt_text
+    # Get the current system prompt; almost always served from the in-process cache
+    system_prompt = (await crud.get_system_prompt(db)).prompt_text
+
     logger.info("Using current system prompt for question generation.")
 
+    # End the read transaction so its pooled connection isn't held for the
+    # whole (slow) LLM call; the UPDATE below checks out a connection again.
+    await db.commit()
+
     # Generate question using OpenRouter client, passing assignment, response and system prompt
     generated_question = await openrouter_client.generate_follow_up_question(
         assignment_prompt=assignment_prompt,
@@ -236,18 +398,18 @@ async def generate_question(
     )
 
     # Update the submission record with the generated question
-    updated_submission = await crud.update_submission_question(
+    updated_id = await crud.update_submission_question(
         db=db,
         submission_id=submission_id,
         question=generated_question
     )
 
-    if not updated_submission:
-         # This shouldn't happen if get_submission succeeded, but handle defensively
-        logger.error(f"Failed to update submission {submission_id} with generated question.")
+    if updated_id is None:
+         # This shouldn't happen if get_submission_with_assignment succeeded, but handle defensively
+        logger.error("Failed to update submission %s with generated question.", submission_id)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to save generated question")
 
-    logger.info(f"Successfully generated and saved question for submission ID: {submission_id}")
+    logger.info("Successfully generated and saved question for submission ID: %s", submission_id)
     return schemas.QuestionGeneratedResponse(
         submission_id=submission_id,
         generated_question=generated_question
@@ -264,29 +426,32 @@ async def verify_response(
     """
     submission_id = response_data.submission_id
     student_response = response_data.student_response
-    logger.info(f"Received response for submission ID: {submission_id}")
+    logger.info("Received response for submission ID: %s", submission_id)
 
     # Update the submission record with the student's response
-    updated_submission = await crud.update_submission_response(
+    updated_id = await crud.update_submission_response(
         db=db,
         submission_id=submission_id,
         response=student_response
     )
 
-    if not updated_submission:
-        logger.warning(f"Submission ID {submission_id} not found when trying to store response.")
+    if updated_id is None:
+        logger.warning("Submission ID %s not found when trying to store response.", submission_id)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Submission not found")
 
-    logger.info(f"Successfully stored response for submission ID: {submission_id}")
+    logger.info("Successfully stored response for submission ID: %s", submission_id)
     return schemas.ResponseVerifiedResponse(submission_id=submission_id)
 
 # --- Prompt Management Endpoints ---
 @app.get("/api/prompt", response_model=schemas.PromptRead, tags=["Prompt Management"])
-async def read_system_prompt(db: AsyncSession = Depends(get_db)):
-    """Retrieve the current system prompt."""
+async def read_system_prompt(request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    Retrieve the current system prompt.
+    Uses a committing session: the default row may be created on first read.
+    """
     logger.info("Fetching current system prompt.")
     prompt = await crud.get_system_prompt(db)
-    return prompt
+    return _cached_json_response(request, schemas.PromptRead.model_validate(prompt))
 
 @app.put("/api/prompt", response_model=schemas.PromptRead, tags=["Prompt Management"])
 async def update_system_prompt(
@@ -294,10 +459,13 @@ async def update_system_prompt(
     db: AsyncSession = Depends(get_db)
 ):
     """Update the system prompt used for generating follow-up questions."""
-    logger.info(f"Updating system prompt: {prompt_data.prompt_text[:50]}...")
+    logger.info("Updating system prompt: %.50s...", prompt_data.prompt_text)
     updated_prompt = await crud.update_system_prompt(db=db, prompt_update=prompt_data)
+    # Commit before caching so other requests never see an uncommitted prompt
+    await db.commit()
+    crud.cache_system_prompt(updated_prompt)
     logger.info("System prompt updated successfully.")
-    return updated_prompt
+    return _written_row_response(schemas.PromptRead, updated_prompt)
 
 # Example of how to include routers from other files if the app grows:
 # from .routers import items, users
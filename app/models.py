@@ -6,8 +6,10 @@ assignment submissions, generated questions, and student responses.
 """
 
 import datetime
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, func, Boolean
-from sqlalchemy.orm import relationship
+from typing import List, Optional
+
+from sqlalchemy import Integer, String, Text, DateTime, ForeignKey, func, Boolean, Index, text
+from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .database import Base
 
@@ -24,15 +26,21 @@ class Assignment(Base):
     Only one assignment can be marked as current.
     """
     __tablename__ = "assignments"
+    __table_args__ = (
+        # Partial unique index: at most one row can be current, and looking it up is an index hit
+        Index("ix_assignments_current", "is_current", unique=True, postgresql_where=text("is_current")),
+    )
+    # Fetch server-generated timestamps in the INSERT/UPDATE itself rather than on next access
+    __mapper_args__ = {"eager_defaults": True}
     
-    id = Column(Integer, primary_key=True, index=True)
-    prompt_text = Column(Text, nullable=False)
-    is_current = Column(Boolean, default=False, index=True) # Flag for the currently active assignment
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now(), server_default=func.now())
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    prompt_text: Mapped[str] = mapped_column(Text, nullable=False)
+    is_current: Mapped[Optional[bool]] = mapped_column(Boolean, default=False) # Flag for the currently active assignment
+    created_at: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    updated_at: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime(timezone=True), onupdate=func.now(), server_default=func.now())
     
     # Relationship to submissions
-    submissions = relationship("Submission", back_populates="assignment")
+    submissions: Mapped[List["Submission"]] = relationship(back_populates="assignment")
 
 class Submission(Base):
     """
@@ -40,25 +48,26 @@ class Submission(Base):
     submission, the generated question, and the final response.
     """
     __tablename__ = "submissions"
+    __mapper_args__ = {"eager_defaults": True}
 
-    id = Column(Integer, primary_key=True, index=True)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     # For simplicity, storing the original submission directly.
     # In a real app, this might be a file path or reference.
-    original_content = Column(Text, nullable=False)
-    generated_question = Column(Text, nullable=True) # Nullable until generated
-    student_response = Column(Text, nullable=True) # Nullable until provided
+    original_content: Mapped[str] = mapped_column(Text, nullable=False)
+    generated_question: Mapped[Optional[str]] = mapped_column(Text, nullable=True) # Nullable until generated
+    student_response: Mapped[Optional[str]] = mapped_column(Text, nullable=True) # Nullable until provided
     # Consider adding an authenticity score later if needed
-    # authenticity_score = Column(Float, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # authenticity_score: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    created_at: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    updated_at: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime(timezone=True), onupdate=func.now())
 
     # Link to the assignment
-    assignment_id = Column(Integer, ForeignKey("assignments.id"), nullable=True)
-    assignment = relationship("Assignment", back_populates="submissions")
+    assignment_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("assignments.id"), nullable=True)
+    assignment: Mapped[Optional["Assignment"]] = relationship(back_populates="submissions")
 
     # We could add relationships to User or Assignment models later if needed
-    # user_id = Column(Integer, ForeignKey("users.id"))
-    # user = relationship("User")
+    # user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    # user: Mapped["User"] = relationship()
 
 class SystemPrompt(Base):
     """
@@ -67,13 +76,13 @@ class SystemPrompt(Base):
     """
     __tablename__ = "system_prompts"
 
-    id = Column(Integer, primary_key=True, default=1)
-    prompt_text = Column(Text, nullable=False, default=DEFAULT_SYSTEM_PROMPT)
-    # updated_at = Column(DateTime(timezone=True), onupdate=func.now(), server_default=func.now())
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, default=1)
+    prompt_text: Mapped[str] = mapped_column(Text, nullable=False, default=DEFAULT_SYSTEM_PROMPT)
+    # updated_at: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime(timezone=True), onupdate=func.now(), server_default=func.now())
 
 # Example of how other models could be added:
 # class User(Base):
 #     __tablename__ = "users"
-#     id = Column(Integer, primary_key=True, index=True)
-#     username = Column(String, unique=True, index=True)
+#     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+#     username: Mapped[str] = mapped_column(String, unique=True, index=True)
 #     # ... other user fields 
\ No newline at end of file
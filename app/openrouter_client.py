@@ -1,31 +1,138 @@
 """
-Client for interacting with the OpenRouter API using direct HTTP requests.
+Client for interacting with the OpenRouter API using a shared async HTTP client.
 
 Handles sending requests to OpenRouter to generate follow-up questions
 based on student submissions and the configured system prompt.
 Includes fallback mechanisms.
 """
 
-import logging
-import json
-import requests
 import asyncio
-from typing import Dict, List, Any
+import functools
+import hashlib
+import logging
+import time
+import httpx
+import orjson
+from cachetools import TTLCache
+from typing import Dict
 
 from .config import get_settings
+from .schemas import MAX_SUBMISSION_LENGTH
 
-# --- Settings and Logger ---
-settings = get_settings()
+# --- Logger ---
 logger = logging.getLogger(__name__)
 
 # --- Constants ---
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 DEFAULT_FALLBACK_QUESTION = "Please elaborate on the main point of your submission."
 FREE_MODEL = "mistralai/mistral-7b-instruct:free"  
+TEMPERATURE = 0.7
+MAX_TOKENS = 70
+# The answer is streamed and reading stops at the first complete question,
+# so generation isn't paid for up to max_tokens when the question ends early
+QUESTION_MIN_LENGTH = 20
+QUESTION_TERMINATORS = ("?", "？")
+
+# --- Static Request Parts ---
+# Built once at import; each call only fills in the variable texts.
+# The Authorization header is added when the client is created.
+_STATIC_HEADERS = {
+    "Content-Type": "application/json",
+    "HTTP-Referer": "https://illia-shyn.github.io/ThoughtCaptcha/",  # Updated URL
+    "X-Title": "ThoughtCaptcha",
+}
+_PAYLOAD_TEMPLATE = {"model": FREE_MODEL, "max_tokens": MAX_TOKENS, "temperature": TEMPERATURE, "stream": True}
+_USER_PREFIX = "Assignment Question:\n```\n"
+_USER_MIDDLE = "\n```\n\nStudent's Response:\n```\n"
+_USER_SUFFIX = "\n```\n\nGenerate a concise follow-up question based on the student's response in the context of the assignment question:"
+# The JSON body around the two message texts, encoded once. The prefix is
+# derived from _PAYLOAD_TEMPLATE so the two can't drift apart.
+_PAYLOAD_PREFIX = orjson.dumps(_PAYLOAD_TEMPLATE)[:-1] + b',"messages":[{"role":"system","content":'
+_PAYLOAD_MIDDLE = b'},{"role":"user","content":'
+_PAYLOAD_SUFFIX = b'}]}'
+
+@functools.lru_cache(maxsize=4)
+def _encode_system_prompt(system_prompt: str) -> bytes:
+    # The system prompt rarely changes, so its JSON encoding is memoized
+    return orjson.dumps(system_prompt)
+
+# --- HTTP Client ---
+# One client per process: connections (and TLS sessions) are kept alive and
+# reused, and HTTP/2 multiplexes concurrent requests over them.
+_client: httpx.AsyncClient | None = None
+
+def _get_client() -> httpx.AsyncClient:
+    """Returns the shared client, creating it (and reading settings) on first use."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=OPENROUTER_BASE_URL,
+            headers={**_STATIC_HEADERS, "Authorization": f"Bearer {get_settings().OPENROUTER_API_KEY}"},
+            http2=True,
+            # Connecting and getting a pooled connection should be quick, so a provider
+            # that can't be reached fails over within seconds; reads allow for slow generation
+            timeout=httpx.Timeout(connect=2.0, read=15.0, write=5.0, pool=1.0),
+            limits=httpx.Limits(max_connections=128, max_keepalive_connections=64),
+        )
+    return _client
+
+async def close_client() -> None:
+    """Closes pooled connections. Called from the app lifespan on shutdown."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+# --- Circuit Breaker ---
+# After BREAKER_FAILURE_THRESHOLD consecutive failures (timeouts, connection
+# errors, 5xx), calls return the fallback immediately for BREAKER_OPEN_SECONDS
+# instead of each waiting on an OpenRouter outage. Afterwards calls go through
+# again: one more failure reopens the breaker, a success closes it.
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_OPEN_SECONDS = 30.0
+_breaker = {"fails": 0, "open_until": 0.0}
+
+def _record_failure() -> None:
+    _breaker["fails"] += 1
+    if _breaker["fails"] >= BREAKER_FAILURE_THRESHOLD:
+        _breaker["open_until"] = time.monotonic() + BREAKER_OPEN_SECONDS
+        logger.warning("OpenRouter circuit breaker open for %ss after %s consecutive failures.",
+                       BREAKER_OPEN_SECONDS, _breaker["fails"])
+
+def _record_success() -> None:
+    _breaker["fails"] = 0
+
+class _StreamError(Exception):
+    """An error chunk sent by OpenRouter after the 200 status (e.g. upstream overload)."""
+
+# --- Response Cache and In-Flight Coalescing ---
+# Identical inputs (same model, prompts and response text) reuse a previous
+# answer for an hour, and concurrent identical calls share one OpenRouter
+# request. Despite temperature > 0 the answers are cached: any suitable
+# follow-up question is acceptable, and a submission's question is stored
+# once generated anyway. Only real answers are cached, never the fallback.
+RESPONSE_CACHE_TTL_SECONDS = 3600
+_response_cache = TTLCache(maxsize=4096, ttl=RESPONSE_CACHE_TTL_SECONDS)
+_inflight: Dict[str, asyncio.Task] = {}
+
+def cache_key(assignment_prompt: str, student_response: str, system_prompt: str) -> str:
+    """
+    Derives the exact-match cache key for a request. Everything that affects
+    the answer is part of the key, so a different model or prompt never hits.
+    """
+    return hashlib.sha256(orjson.dumps({
+        "m": FREE_MODEL,
+        "s": system_prompt,
+        "a": assignment_prompt,
+        "u": student_response,
+        "t": TEMPERATURE,
+    })).hexdigest()
 
 async def generate_follow_up_question(assignment_prompt: str, student_response: str, system_prompt: str) -> str:
     """
-    Calls the OpenRouter API using direct HTTP requests to generate a contextual question.
+    Generates a contextual follow-up question via OpenRouter.
+    Identical inputs are answered from the response cache, or wait for an
+    already in-flight request, instead of calling the API again.
 
     Args:
         assignment_prompt: The text of the assignment question/prompt.
@@ -35,74 +142,137 @@ async def generate_follow_up_question(assignment_prompt: str, student_response:
     Returns:
         The generated question as a string, or a fallback question if the API call fails.
     """
-    if not settings.OPENROUTER_API_KEY:
+    key = cache_key(assignment_prompt, student_response, system_prompt)
+    cached_question = _response_cache.get(key)
+    if cached_question is not None:
+        logger.info("Returning cached OpenRouter response for identical input.")
+        return cached_question
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_fetch_and_cache(key, assignment_prompt, student_response, system_prompt))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    else:
+        logger.info("Joining in-flight OpenRouter request for identical input.")
+    # Shielded so one caller disconnecting doesn't cancel the request for the others
+    return await asyncio.shield(task)
+
+async def _fetch_and_cache(key: str, assignment_prompt: str, student_response: str, system_prompt: str) -> str:
+    question = await _request_follow_up_question(assignment_prompt, student_response, system_prompt)
+    if question != DEFAULT_FALLBACK_QUESTION: # Failures should be retried, not remembered
+        _response_cache[key] = question
+    return question
+
+async def _request_follow_up_question(assignment_prompt: str, student_response: str, system_prompt: str) -> str:
+    """Sends one question-generation request to OpenRouter; never raises, returns the fallback on error."""
+    if not get_settings().OPENROUTER_API_KEY:
         logger.warning("OPENROUTER_API_KEY not set. Returning fallback question.")
         return DEFAULT_FALLBACK_QUESTION
 
-    # Define headers
-    headers = {
-        "Authorization": f"Bearer {settings.OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "https://illia-shyn.github.io/ThoughtCaptcha/",  # Updated URL
-        "X-Title": "ThoughtCaptcha",
-    }
+    if time.monotonic() < _breaker["open_until"]:
+        logger.warning("OpenRouter circuit breaker is open. Returning fallback question.")
+        return DEFAULT_FALLBACK_QUESTION
+
+    # Submissions are length-checked on input; truncate anyway so older or
+    # directly-inserted rows can't blow up the prompt
+    student_response = student_response[:MAX_SUBMISSION_LENGTH]
 
     # Create request payload with both assignment prompt and student response
-    payload = {
-        "model": FREE_MODEL,
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"Assignment Question:\n```\n{assignment_prompt}\n```\n\nStudent's Response:\n```\n{student_response}\n```\n\nGenerate a concise follow-up question based on the student's response in the context of the assignment question:"}
-        ],
-        "max_tokens": 70,
-        "temperature": 0.7
-    }
+    user_message = "".join((_USER_PREFIX, assignment_prompt, _USER_MIDDLE, student_response, _USER_SUFFIX))
+    body = b"".join((
+        _PAYLOAD_PREFIX,
+        _encode_system_prompt(system_prompt),
+        _PAYLOAD_MIDDLE,
+        orjson.dumps(user_message),
+        _PAYLOAD_SUFFIX,
+    ))
 
     # Log the request we're about to send
-    logger.info(f"Sending request to OpenRouter with model: {FREE_MODEL}")
+    logger.info("Sending request to OpenRouter with model: %s", FREE_MODEL)
     
-    # Using asyncio.to_thread to run the requests call asynchronously
     try:
-        # Run the HTTP request in a thread to not block the event loop
-        response = await asyncio.to_thread(
-            requests.post,
-            url=OPENROUTER_API_URL,
-            headers=headers,
-            data=json.dumps(payload),
-            timeout=30.0
-        )
+        async with _get_client().stream("POST", "/chat/completions", content=body) as response:
+            # Process the response
+            logger.info("OpenRouter response status: %s", response.status_code)
+
+            if response.status_code != 200:
+                if response.status_code >= 500: # Provider-side trouble, unlike a bad request
+                    _record_failure()
+                # Log more details about the error response
+                await response.aread()
+                try:
+                    error_details = orjson.loads(response.content)
+                    logger.error("OpenRouter API error: %s - %s", response.status_code, error_details)
+                except:
+                    logger.error("OpenRouter API status error: %s - %s", response.status_code, response.text)
+                return DEFAULT_FALLBACK_QUESTION
 
-        # Process the response
-        logger.info(f"OpenRouter response status: {response.status_code}")
-        
-        if response.status_code == 200:
-            response_data = response.json()
-            if response_data and "choices" in response_data and len(response_data["choices"]) > 0:
-                generated_question = response_data["choices"][0]["message"]["content"].strip()
-                if generated_question:
-                    logger.info(f"Successfully generated question based on assignment and student response")
-                    return generated_question
-
-            logger.warning("OpenRouter response did not contain the expected data structure.")
-            return DEFAULT_FALLBACK_QUESTION
-        else:
-            # Log more details about the error response
-            try:
-                error_details = response.json()
-                logger.error(f"OpenRouter API error: {response.status_code} - {error_details}")
-            except:
-                logger.error(f"OpenRouter API status error: {response.status_code} - {response.text}")
-            return DEFAULT_FALLBACK_QUESTION
-
-    except requests.exceptions.Timeout:
+            # Leaving the block closes the stream, aborting any remaining generation
+            generated_question = await _read_streamed_question(response)
+
+        if generated_question:
+            _record_success() # Only real content proves the provider is healthy
+            logger.info("Successfully generated question based on assignment and student response")
+            return generated_question
+
+        logger.warning("OpenRouter response did not contain the expected data structure.")
+        return DEFAULT_FALLBACK_QUESTION
+
+    except _StreamError as e:
+        _record_failure()
+        logger.error("OpenRouter API stream error: %s", e)
+    except httpx.ConnectTimeout:
+        _record_failure()
+        logger.error("OpenRouter API connect timed out (provider unreachable).")
+    except httpx.PoolTimeout:
+        # Local saturation rather than a provider fault, so the breaker isn't tripped
+        logger.error("Timed out waiting for a free OpenRouter connection (client pool exhausted).")
+    except httpx.ReadTimeout:
+        _record_failure()
+        logger.error("OpenRouter API read timed out (provider slow to respond).")
+    except httpx.TimeoutException:
+        _record_failure()
         logger.error("OpenRouter API request timed out.")
-    except requests.exceptions.ConnectionError as e:
-        logger.error(f"OpenRouter API connection error: {e}")
-    except json.JSONDecodeError:
+    except httpx.TransportError as e:
+        _record_failure()
+        logger.error("OpenRouter API connection error: %s", e)
+    except orjson.JSONDecodeError:
         logger.error("Failed to parse OpenRouter API response as JSON.")
     except Exception as e:
-        logger.error(f"An unexpected error occurred calling OpenRouter: {e}", exc_info=True)
+        logger.error("An unexpected error occurred calling OpenRouter: %s", e, exc_info=True)
 
     # If any error occurred, return the fallback
     logger.warning("Returning fallback question due to API error or invalid response.")
-    return DEFAULT_FALLBACK_QUESTION 
\ No newline at end of file
+    return DEFAULT_FALLBACK_QUESTION 
+
+async def _read_streamed_question(response: httpx.Response) -> str:
+    """
+    Accumulates the streamed (SSE) content deltas of a completion.
+    Stops at the first complete question instead of reading to the end.
+    """
+    parts = []
+    length = 0
+    async for line in response.aiter_lines():
+        # Skip blank separators and SSE comments (e.g. ": OPENROUTER PROCESSING")
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        chunk = orjson.loads(data)
+        if "error" in chunk:
+            # Errors after the 200 status arrive as a chunk in the stream
+            raise _StreamError(chunk["error"])
+        choices = chunk.get("choices")
+        if not choices:
+            continue
+        content = choices[0].get("delta", {}).get("content")
+        if content:
+            # Collected as parts and joined once, rather than re-copying the text on every delta
+            parts.append(content)
+            length += len(content)
+            if length > QUESTION_MIN_LENGTH and content.rstrip().endswith(QUESTION_TERMINATORS):
+                break
+    # Models often lead with a space or newline, so both ends are stripped
+    return "".join(parts).strip()
@@ -6,9 +6,15 @@ transferred through the API (request bodies, response models).
 """
 
 import datetime
-from pydantic import BaseModel, Field
+import msgspec
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional
 
+# Upper bounds on student-supplied text. They keep the OpenRouter prompt (and
+# so its latency and token cost) bounded; longer input is rejected with a 422.
+MAX_SUBMISSION_LENGTH = 8000
+MAX_STUDENT_RESPONSE_LENGTH = 4000
+
 # --- Assignment Schemas ---
 class AssignmentBase(BaseModel):
     """Base schema for assignment data."""
@@ -30,8 +36,7 @@ class AssignmentRead(AssignmentBase):
     created_at: datetime.datetime
     updated_at: Optional[datetime.datetime] = None
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, extra="ignore")
 
 # --- Base Schemas ---
 class SubmissionBase(BaseModel):
@@ -40,6 +45,8 @@ class SubmissionBase(BaseModel):
 
 class SubmissionCreate(SubmissionBase):
     """Schema for creating a new submission record."""
+    # Limit applied on input only, so rows stored before it still serialize
+    original_content: str = Field(..., description="The initial content submitted by the student.", max_length=MAX_SUBMISSION_LENGTH)
     assignment_id: Optional[int] = None
 
 class QuestionGenerate(BaseModel):
@@ -49,7 +56,7 @@ class QuestionGenerate(BaseModel):
 class ResponseVerify(BaseModel):
     """Schema for submitting the student's response to the follow-up question."""
     submission_id: int = Field(..., description="The ID of the submission this response belongs to.")
-    student_response: str = Field(..., description="The student's answer to the follow-up question.")
+    student_response: str = Field(..., description="The student's answer to the follow-up question.", max_length=MAX_STUDENT_RESPONSE_LENGTH)
 
 # --- Prompt Schemas ---
 class PromptBase(BaseModel):
@@ -62,8 +69,7 @@ class PromptRead(PromptBase):
     id: int = 1 # Usually fixed at 1
     # updated_at: Optional[datetime.datetime] = None
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, extra="ignore")
 
 # --- Response Schemas ---
 class Submission(SubmissionBase):
@@ -75,15 +81,13 @@ class Submission(SubmissionBase):
     created_at: datetime.datetime
     updated_at: Optional[datetime.datetime] = None
 
-    class Config:
-        from_attributes = True # Renamed from orm_mode in Pydantic v2
+    model_config = ConfigDict(from_attributes=True, extra="ignore") # from_attributes was orm_mode in Pydantic v1
 
 class SubmissionFullData(Submission):
     """Schema for retrieving full submission data for teacher view."""
     assignment: Optional[AssignmentRead] = None
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, extra="ignore")
 
 class QuestionGeneratedResponse(BaseModel):
     """Response schema after successfully generating a question."""
@@ -98,4 +102,26 @@ class ResponseVerifiedResponse(BaseModel):
 # --- Health Check Schema ---
 class HealthCheckResponse(BaseModel):
     """Schema for the health check endpoint response."""
-    status: str = "OK" 
\ No newline at end of file
+    status: str = "OK" 
+
+# --- Response Encoding Structs ---
+# Lightweight mirrors of AssignmentRead / SubmissionFullData for list
+# endpoints. Rows straight from the database need no validation, so they are
+# wrapped in these C-level structs and encoded with msgspec instead of going
+# through Pydantic. Field order matches the Pydantic models, so the JSON is identical.
+class AssignmentReadStruct(msgspec.Struct, frozen=True):
+    prompt_text: str
+    is_current: Optional[bool]
+    id: int
+    created_at: datetime.datetime
+    updated_at: Optional[datetime.datetime]
+
+class SubmissionFullDataStruct(msgspec.Struct, frozen=True):
+    original_content: str
+    id: int
+    generated_question: Optional[str]
+    student_response: Optional[str]
+    assignment_id: Optional[int]
+    created_at: datetime.datetime
+    updated_at: Optional[datetime.datetime]
+    assignment: Optional[AssignmentReadStruct]